@@ -0,0 +1,120 @@
+"""
+This script is used to run several analyses on a log file while reading and
+parsing it only once:
+ - deltas: delta time between lines, as computed by deltime_logs
+ - firstlast: first and last logs for each key, as found by first_and_last_log
+ - compare: relevant data stored in a folder, as extracted by log_smart_compare
+"""
+import re
+import datetime
+from log_types import (
+    LOG_CONFIG_ARG,
+    open_log_file,
+    get_log_config_from_arg,
+    get_field_names,
+    analyse_file,
+)
+import deltime_logs
+import first_and_last_log
+import log_smart_compare
+
+
+ANALYSES = ["deltas", "firstlast", "compare"]
+
+
+def is_available(analysis_name, log_type):
+    """Check if analysis can be performed on logs of the given type."""
+    if analysis_name == "deltas":
+        return log_type.date_obj_from_str is not None and "date" in get_field_names(
+            log_type
+        )
+    if analysis_name == "firstlast":
+        key_format = first_and_last_log.KEY_FORMATS.get(log_type.name)
+        return key_format is not None and set(
+            re.findall(r"{(\w+)}", key_format)
+        ) <= set(get_field_names(log_type))
+    return log_type.name in log_smart_compare.OUTPUT_FORMATS
+
+
+def get_analysis_names(name, log_type, requested_names, default_names=ANALYSES):
+    """Get names of analyses to perform on input called name.
+
+    Without requested analyses, default analyses unavailable for the log type
+    are skipped with a note. Requested analyses which are unavailable raise
+    a ValueError."""
+    if requested_names is None:
+        for analysis_name in default_names:
+            if not is_available(analysis_name, log_type):
+                print(
+                    "%s: skipping %s analysis, not available for %s format"
+                    % (name, analysis_name, log_type.name)
+                )
+        return [n for n in default_names if is_available(n, log_type)]
+    unavailable = [n for n in requested_names if not is_available(n, log_type)]
+    if unavailable:
+        raise ValueError(
+            "%s analysis not available for %s format"
+            % (", ".join(unavailable), log_type.name)
+        )
+    return requested_names
+
+
+def get_analyses(name, log_type, analysis_names, args):
+    """Get analyses of input called name, options being taken from argparse arguments."""
+    analyses = []
+    if "deltas" in analysis_names:
+        delta = datetime.timedelta(milliseconds=args.delta)
+        analyses.append(
+            deltime_logs.DeltaTimeAnalysis(
+                log_type, args.ref_type, args.reference, delta, args.outputformat
+            )
+        )
+    if "firstlast" in analysis_names:
+        analyses.append(first_and_last_log.FirstAndLastAnalysis(log_type))
+    if "compare" in analysis_names:
+        analyses.append(
+            log_smart_compare.CompareFolderAnalysis(
+                name,
+                log_type,
+                log_smart_compare.get_group_keys(args),
+                args.max_open_files,
+                log_smart_compare.get_pattern_matcher(args),
+            )
+        )
+    return analyses
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Define argparse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "file",
+        type=open_log_file,
+        help="Input file",
+    )
+    parser.add_argument("-format", **LOG_CONFIG_ARG)
+    parser.add_argument(
+        "-analysis",
+        action="append",
+        choices=ANALYSES,
+        help="Analysis to perform (can be used multiple times). Defaults to all of them: %s"
+        % ANALYSES,
+    )
+    deltime_logs.add_arguments(parser)
+    log_smart_compare.add_extraction_arguments(parser)
+
+    # Get arguments
+    args = parser.parse_args()
+    input_file = args.file
+    log_type = get_log_config_from_arg(args.format, [input_file])
+    try:
+        analysis_names = get_analysis_names(input_file.name, log_type, args.analysis)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Do process
+    analyse_file(
+        input_file, log_type, get_analyses(input_file.name, log_type, analysis_names, args)
+    )
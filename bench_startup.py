@@ -0,0 +1,113 @@
+"""
+This script is used to measure the startup time of the log scripts: each
+script is run several times on a small log file, as done from test harnesses,
+so that the time measured is dominated by imports and initialisation.
+Results can be saved and compared with previous results to track regressions.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import statistics
+import subprocess
+
+from log_types import LogcatLogType
+
+# Folder containing the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_benchmarks(log_file):
+    """Get dictionnary mapping benchmark names to the command to run."""
+    return {
+        "import log_types": ["-c", "import log_types"],
+        "import log_smart_compare": ["-c", "import log_smart_compare"],
+        "deltime_logs": ["deltime_logs.py", log_file],
+        "deltime_logs -format": ["deltime_logs.py", log_file, "-format", "logcat"],
+        "first_and_last_log": ["first_and_last_log.py", log_file],
+        "log_smart_compare": [
+            "log_smart_compare.py",
+            log_file,
+            log_file,
+            "-report",
+            "text",
+            "-jobs",
+            "1",
+        ],
+        "analyse_logs": ["analyse_logs.py", log_file],
+    }
+
+
+def time_command(args, runs, env=None):
+    """Run command several times - return the durations (in ms)."""
+    durations = []
+    for _ in range(runs):
+        begin = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            cwd=SCRIPTS_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        durations.append((time.perf_counter() - begin) * 1000)
+    return durations
+
+
+def run_benchmarks(runs):
+    """Run benchmarks on a small log file - return dictionnary mapping names to median duration (in ms)."""
+    # Folders created by the scripts are removed with the temporary folder
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, TMPDIR=tmpdir)
+        log_file = os.path.join(tmpdir, "bench.log")
+        with open(log_file, "w") as f:
+            for line in LogcatLogType.examples:
+                f.write(line + "\n")
+        # Warm up so that compiled bytecode is available
+        time_command(["-m", "compileall", "-q", SCRIPTS_DIR], 1)
+        return {
+            name: statistics.median(time_command(args, runs, env))
+            for name, args in get_benchmarks(log_file).items()
+        }
+
+
+def print_results(results, reference):
+    for name, duration in results.items():
+        line = "%-25s %8.1f ms" % (name, duration)
+        ref_duration = reference.get(name)
+        if ref_duration:
+            line += " (%+.0f%% vs %.1f ms)" % (
+                100.0 * (duration - ref_duration) / ref_duration,
+                ref_duration,
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Define argparse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-runs",
+        default=20,
+        type=int,
+        help="Number of runs for each benchmark (median is reported)",
+    )
+    parser.add_argument("-save", help="JSON file to save results in")
+    parser.add_argument("-compare", help="JSON file with results to compare with")
+
+    # Get arguments
+    args = parser.parse_args()
+    reference = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+
+    # Do process
+    results = run_benchmarks(args.runs)
+    print_results(results, reference)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
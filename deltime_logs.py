@@ -6,34 +6,12 @@ import re
 import datetime
 from log_types import (
     LOG_CONFIG_ARG,
+    open_log_file,
     get_log_config_from_arg,
+    analyse_file,
 )
 
 
-def get_timed_lines(input_file, log_re, date_obj_from_str):
-    no_match = list()
-    lines = list(input_file)
-    for line in lines:
-        line = line.strip()
-        if line:
-            m = re.match(log_re, line)
-            if m is None:
-                no_match.append(line)
-            else:
-                d = date_obj_from_str(m.groupdict()["date"])
-                yield d, line
-    if no_match:
-        log = "%s lines from %s did not match (out of %s):" % (
-            len(no_match),
-            input_file.name,
-            len(lines),
-        )
-        print(log)
-        for line in no_match:
-            print("  '" + line + "'")
-        print(log)
-
-
 def get_ms(td, delta):
     if td is None:
         return ""
@@ -55,9 +33,10 @@ def get_diff_from_rel_time(timed_lines, re_ref):
         yield diff, line
 
 
-def process_file(input_file, log_type, ref_type, reference, delta, output_format):
-    log_re, date_obj_from_str = log_type.regex, log_type.date_obj_from_str
-    timed_lines = list(get_timed_lines(input_file, log_re, date_obj_from_str))
+def process_timed_lines(
+    timed_lines, log_type, ref_type, reference, delta, output_format
+):
+    date_obj_from_str = log_type.date_obj_from_str
     do_reverse = ref_type in ("last", "next")
     if do_reverse:
         timed_lines = list(reversed(timed_lines))
@@ -84,17 +63,40 @@ def process_file(input_file, log_type, ref_type, reference, delta, output_format
         print(output_format.format(get_ms(diff, delta), line))
 
 
-if __name__ == "__main__":
-    import argparse
+class DeltaTimeAnalysis:
+    """Analysis computing delta times between lines, to be used with analyse_file."""
 
-    # Define argparse arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "file",
-        type=argparse.FileType("r", encoding="ISO-8859-1"),
-        help="Input file",
-    )
-    parser.add_argument("-format", **LOG_CONFIG_ARG)
+    def __init__(self, log_type, ref_type, reference, delta, output_format):
+        self.log_type = log_type
+        self.ref_type = ref_type
+        self.reference = reference
+        self.delta = delta
+        self.output_format = output_format
+        self.timed_lines = list()
+
+    def add(self, line, fields):
+        if fields is not None:
+            d = self.log_type.date_obj_from_str(fields["date"])
+            self.timed_lines.append((d, line))
+
+    def finish(self):
+        process_timed_lines(
+            self.timed_lines,
+            self.log_type,
+            self.ref_type,
+            self.reference,
+            self.delta,
+            self.output_format,
+        )
+
+
+def process_file(input_file, log_type, ref_type, reference, delta, output_format):
+    analysis = DeltaTimeAnalysis(log_type, ref_type, reference, delta, output_format)
+    analyse_file(input_file, log_type, [analysis])
+
+
+def add_arguments(parser):
+    """Add arguments specific to this script to the argparse parser."""
     parser.add_argument(
         "-ref-type",
         choices=["absolute", "first", "last", "prev", "next"],
@@ -122,6 +124,20 @@ if __name__ == "__main__":
         ),
     )
 
+
+if __name__ == "__main__":
+    import argparse
+
+    # Define argparse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "file",
+        type=open_log_file,
+        help="Input file",
+    )
+    parser.add_argument("-format", **LOG_CONFIG_ARG)
+    add_arguments(parser)
+
     # Get arguments
     args = parser.parse_args()
     print(args)
@@ -3,76 +3,59 @@ This script is used to find the first and last logs for a given process or
 thread.
 """
 
-import sys
-import re
-import tempfile
-import os
-import subprocess
 from log_types import (
-    LOG_TYPES,
     LOG_CONFIG_ARG,
+    open_log_file,
     get_log_config_from_arg,
-    UlogcatLongLogType,
-    UlogcatShortLogType,
-    LogcatLogType,
-    DmesgDefaultLogType,
-    DmesgHumanTimestampsLogType,
-    DmesgRawLogType,
-    JenkinsLogType,
-    JournalCtlLogType,
-    SysLogLogType,
-    ZazuSocLogType,
-    PctsLogTypes,
+    analyse_file,
 )
 
 
-# Add information about the key format to the log types
-UlogcatLongLogType.key_format = "{processid}/{threadid}"
-UlogcatShortLogType.key_format = "{processid}"
-ZazuSocLogType.key_format = "{processname}"
-LogcatLogType.key_format = "{processid}/{threadid}"
-DmesgDefaultLogType.key_format = "NO KEY DEFINED"
-DmesgHumanTimestampsLogType.key_format = "NO KEY DEFINED"
-DmesgRawLogType.key_format = "NO KEY DEFINED"
-JenkinsLogType.key_format = "{processid}"
-JournalCtlLogType.key_format = "{processid}"
-SysLogLogType.key_format = "NO KEY DEFINED"
-PctsLogTypes.key_format = "NO KEY DEFINED"
+# Information about the key format for each log type
+KEY_FORMATS = {
+    "ulogcat": "{processid}/{threadid}",
+    "ulogcat_short": "{processid}",
+    "zazusoc": "{processname}",
+    "logcat": "{processid}/{threadid}",
+    "dmesg": "NO KEY DEFINED",
+    "dmesg_humantime": "NO KEY DEFINED",
+    "dmesg_raw": "NO KEY DEFINED",
+    "jenkins": "{processid}",
+    "journalctl": "{processid}",
+    "syslog": "NO KEY DEFINED",
+    "pcts": "NO KEY DEFINED",
+}
 
 
-def process_file(input_file, log_type):
-    log_re = log_type.regex
-    key_format = log_type.key_format
-    no_match = list()
-    lines_by_key = dict()
-    lines = list(input_file)
-    for line in lines:
-        line = line.strip()
-        if line:
-            m = re.match(log_re, line)
-            if m is None:
-                no_match.append(line)
+class FirstAndLastAnalysis:
+    """Analysis finding first and last lines for each key, to be used with analyse_file."""
+
+    def __init__(self, log_type):
+        self.key_format = KEY_FORMATS[log_type.name]
+        # Map each key to [number of lines, first line, last line]
+        self.lines_by_key = dict()
+
+    def add(self, line, fields):
+        if fields is not None:
+            key_str = self.key_format.format(**fields)
+            lines = self.lines_by_key.get(key_str)
+            if lines is None:
+                self.lines_by_key[key_str] = [1, line, line]
             else:
-                d = m.groupdict()
-                key_str = key_format.format(**d)
-                lines_by_key.setdefault(key_str, []).append(line)
-    if no_match:
-        log = "%s lines from %s did not match (out of %s):" % (
-            len(no_match),
-            input_file.name,
-            len(lines),
-        )
-        print(log)
-        for line in no_match:
-            print("  '" + line + "'")
-        print(log)
+                lines[0] += 1
+                lines[2] = line
 
-    for k, v_lst in lines_by_key.items():
-        print()
-        print(k, len(v_lst))
-        print(v_lst[0])
-        if len(v_lst) > 1:
-            print(v_lst[-1])
+    def finish(self):
+        for k, (count, first, last) in self.lines_by_key.items():
+            print()
+            print(k, count)
+            print(first)
+            if count > 1:
+                print(last)
+
+
+def process_file(input_file, log_type):
+    analyse_file(input_file, log_type, [FirstAndLastAnalysis(log_type)])
 
 
 if __name__ == "__main__":
@@ -82,7 +65,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "file",
-        type=argparse.FileType("r", encoding="ISO-8859-1"),
+        type=open_log_file,
         help="Input file",
     )
     parser.add_argument("-format", **LOG_CONFIG_ARG)
@@ -0,0 +1,441 @@
+"""
+This script is used to analyse logs captured live from several sources at the
+same time, for instance logcat, ulogcat and dmesg from several devices.
+Sources can be:
+ - files, possibly followed as they are appended (like "tail -f"), or named pipes
+ - the standard input ("-")
+ - the standard output of a command ("cmd:adb logcat")
+All sources are read concurrently from a single thread with asyncio: each
+source has its own bounded queue so that a slow analysis applies backpressure
+to its source only and a stalled source does not block the others.
+The log format is detected for each source and lines are handed to the
+analyses from analyse_logs (deltas and first/last by default, when available
+for the format).
+"""
+import os
+import sys
+import errno
+import stat
+import signal
+import asyncio
+from log_types import (
+    LOG_CONFIGS,
+    LOG_CONFIG_ARG,
+    LOG_ENCODING,
+    open_log,
+    detect_log_type,
+    choose_detected_log_type,
+    UnmatchedReport,
+)
+import analyse_logs
+import deltime_logs
+import log_smart_compare
+
+# Prefix used to define a command as a source
+COMMAND_PREFIX = "cmd:"
+# Default maximum number of lines waiting to be analysed for each source
+DEFAULT_QUEUE_SIZE = 1000
+# Default number of lines used to detect the format of each source
+DEFAULT_DETECTION_LINES = 100
+# Delay (in seconds) between checks for new data in followed files
+POLL_INTERVAL = 0.1
+# Size hint (in bytes) of the data read at once from files
+READ_SIZE = 64 * 1024
+# Maximum length of a line read from a stream
+STREAM_LIMIT = 1024 * 1024
+
+
+async def iter_file_lines(path, follow):
+    """Yield lines from file (name or descriptor), waiting for new lines at the end if file is followed."""
+    with open_log(path) as f:
+        partial = ""
+        while True:
+            lines = f.readlines(READ_SIZE)
+            if not lines:
+                if not follow:
+                    break
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            for line in lines:
+                # Incomplete line can be completed by the next write
+                if line.endswith("\n"):
+                    yield partial + line
+                    partial = ""
+                else:
+                    partial += line
+            # Reading files does not yield to other sources
+            await asyncio.sleep(0)
+        if partial:
+            yield partial
+
+
+async def iter_stream_lines(reader):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        yield line.decode(LOG_ENCODING)
+
+
+async def iter_pipe_lines(pipe, data=b""):
+    """Yield lines from pipe, data already read from it coming first."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=STREAM_LIMIT)
+    reader.feed_data(data)
+    protocol = asyncio.StreamReaderProtocol(reader)
+    await loop.connect_read_pipe(lambda: protocol, pipe)
+    async for line in iter_stream_lines(reader):
+        yield line
+
+
+async def iter_stdin_lines():
+    async for line in iter_pipe_lines(sys.stdin.buffer):
+        yield line
+
+
+async def iter_special_file_lines(path):
+    """Yield lines from a named pipe or a device without blocking other sources."""
+    # Opening a named pipe without writer would block
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    pipe = os.fdopen(fd, "rb", buffering=0)
+    try:
+        # Reads return no data, as at the end, until a writer opens a named pipe
+        while True:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except BlockingIOError:
+                data = b""
+                break
+            if data:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+    except BaseException:
+        pipe.close()
+        raise
+    async for line in iter_pipe_lines(pipe, data):
+        yield line
+
+
+async def iter_path_lines(path, follow):
+    if stat.S_ISREG(os.stat(path).st_mode):
+        lines = iter_file_lines(path, follow)
+    else:
+        lines = iter_special_file_lines(path)
+    async for line in lines:
+        yield line
+
+
+async def iter_command_lines(command):
+    """Yield lines from the standard output of the command, killing it when done."""
+    # Command runs in its own process group so that the whole pipeline can be killed
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        limit=STREAM_LIMIT,
+        start_new_session=True,
+    )
+    try:
+        async for line in iter_stream_lines(process.stdout):
+            yield line
+    finally:
+        if process.returncode is None:
+            os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+
+
+def get_source_lines(source, follow):
+    if source == "-":
+        # Standard input redirected from a file can not be read as a pipe
+        if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+            return iter_file_lines(sys.stdin.fileno(), follow)
+        return iter_stdin_lines()
+    if source.startswith(COMMAND_PREFIX):
+        return iter_command_lines(source[len(COMMAND_PREFIX) :])
+    return iter_path_lines(source, follow)
+
+
+async def read_source(lines, queue):
+    """Put lines into the queue, None being put at the end."""
+    try:
+        async for line in lines:
+            await queue.put(line)
+    finally:
+        await queue.put(None)
+
+
+def print_source_error(source, error):
+    print("%s: %s: %s" % (source, type(error).__name__, error), file=sys.stderr)
+
+
+async def analyse_source(
+    source, reader, queue, log_type_name, detection_lines, get_analyses
+):
+    """Analyse lines from the queue filled by the reader task - return False if the analysis failed."""
+    try:
+        await analyse_queued_lines(
+            source, queue, log_type_name, detection_lines, get_analyses
+        )
+    except Exception as e:
+        print_source_error(source, e)
+        reader.cancel()
+        # Reader still running may wait for room in the queue for the end marker
+        while not reader.done():
+            if await queue.get() is None:
+                break
+        return False
+    return True
+
+
+async def analyse_queued_lines(
+    source, queue, log_type_name, detection_lines, get_analyses
+):
+    """Get lines from the queue, detect log type and hand lines to the analyses."""
+    log_type = LOG_CONFIGS.get(log_type_name)
+    # Lines waiting for the format to be detected, with their position
+    pending = []
+    analyses = None
+    unmatched_report = None
+    nb_lines = 0
+    line_number = 0
+    offset = 0
+    while True:
+        raw_line = await queue.get()
+        if raw_line is not None:
+            line_number += 1
+            line = raw_line.strip()
+            if line:
+                pending.append((line, line_number, offset))
+            offset += len(raw_line)
+            if not line or (log_type is None and len(pending) < detection_lines):
+                continue
+        if log_type is None:
+            if not pending:
+                break
+            print(source, end=": ")
+            log_type = choose_detected_log_type(
+                detect_log_type([[line for line, _, _ in pending]])
+            )
+        if analyses is None:
+            analyses = get_analyses(source, log_type)
+            unmatched_report = UnmatchedReport(log_type)
+        for line, pending_line_number, pending_offset in pending:
+            nb_lines += 1
+            m = log_type.regex.match(line)
+            fields = None if m is None else m.groupdict()
+            if fields is None:
+                unmatched_report.add(line, pending_line_number, pending_offset)
+            for analysis in analyses:
+                analysis.add(line, fields)
+        pending.clear()
+        if raw_line is None:
+            break
+    print()
+    print("==> %s <==" % source)
+    if unmatched_report is not None:
+        unmatched_report.print_report(source, nb_lines)
+    for analysis in analyses or []:
+        analysis.finish()
+
+
+async def ingest(
+    sources,
+    log_type_name,
+    get_analyses,
+    follow=False,
+    duration=None,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    detection_lines=DEFAULT_DETECTION_LINES,
+):
+    """Read and analyse sources concurrently until they are over, duration (in seconds) expires or SIGINT is received.
+
+    Return the number of sources which could not be read or analysed."""
+    readers, analysers = [], []
+    for source in sources:
+        queue = asyncio.Queue(queue_size)
+        lines = get_source_lines(source, follow)
+        reader = asyncio.create_task(read_source(lines, queue))
+        readers.append(reader)
+        analysers.append(
+            asyncio.create_task(
+                analyse_source(
+                    source, reader, queue, log_type_name, detection_lines, get_analyses
+                )
+            )
+        )
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGINT, stop.set)
+    stop_task = asyncio.create_task(stop.wait())
+    all_analysed = asyncio.gather(*analysers)
+    await asyncio.wait(
+        [all_analysed, stop_task],
+        timeout=duration,
+        return_when=asyncio.FIRST_COMPLETED,
+    )
+    stop_task.cancel()
+    # Stopping readers puts the end marker in the queues
+    for reader in readers:
+        reader.cancel()
+    analysed = await all_analysed
+    read = await asyncio.gather(*readers, return_exceptions=True)
+    nb_failures = 0
+    for source, analysis_ok, result in zip(sources, analysed, read):
+        # Readers stopped before the end of their source are cancelled
+        read_ok = not isinstance(result, Exception)
+        if not read_ok:
+            print_source_error(source, result)
+        if not (read_ok and analysis_ok):
+            nb_failures += 1
+    return nb_failures
+
+
+# TESTS
+#########################################
+class RecordingAnalysis:
+    def __init__(self):
+        self.lines = []
+
+    def add(self, line, fields):
+        self.lines.append(line)
+
+    def finish(self):
+        pass
+
+
+class FailingAnalysis(RecordingAnalysis):
+    def add(self, line, fields):
+        raise ValueError("analysis failure")
+
+
+async def write_slowly(path, lines, delay=0.01):
+    """Fake writer appending lines to a regular file or a named pipe."""
+    # Opening a named pipe for writing fails until a reader has opened it
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            await asyncio.sleep(delay)
+    try:
+        for line in lines:
+            os.write(fd, line.encode(LOG_ENCODING))
+            await asyncio.sleep(delay)
+    finally:
+        os.close(fd)
+
+
+def test_sources_without_blocking():
+    print("test_sources_without_blocking")
+    import tempfile
+
+    lines = ["%s\n" % line for line in LOG_CONFIGS["logcat"].examples]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, name) for name in ("idle", "fifo", "log")]
+        for path in paths[:2]:
+            os.mkfifo(path)
+        open(paths[2], "w").close()
+        recorded = dict()
+
+        def get_analyses(name, log_type):
+            recorded[name] = RecordingAnalysis()
+            return [recorded[name]]
+
+        async def run():
+            # No writer ever opens the first named pipe
+            writers = [write_slowly(path, lines) for path in paths[1:]]
+            ingestion = ingest(paths, "logcat", get_analyses, True, 1)
+            nb_failures, *_ = await asyncio.wait_for(
+                asyncio.gather(ingestion, *writers), timeout=10
+            )
+            return nb_failures
+
+        assert asyncio.run(run()) == 0
+        expected = [line.strip() for line in lines]
+        assert recorded[paths[1]].lines == expected, recorded[paths[1]].lines
+        assert recorded[paths[2]].lines == expected, recorded[paths[2]].lines
+        assert recorded[paths[0]].lines == []
+
+
+def test_failing_analysis():
+    print("test_failing_analysis")
+    import tempfile
+
+    lines = LOG_CONFIGS["logcat"].examples * 1000
+    with tempfile.NamedTemporaryFile("w", suffix=".log") as f:
+        f.write("\n".join(lines))
+        f.flush()
+        get_analyses = lambda name, log_type: [FailingAnalysis()]
+        ingestion = ingest([f.name], "logcat", get_analyses, queue_size=10)
+        # Source must not stay blocked on the queue of its failed analysis
+        assert asyncio.run(asyncio.wait_for(ingestion, timeout=10)) == 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Define argparse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "sources",
+        nargs="+",
+        help='Input sources: file name, "-" for standard input or "%sCOMMAND" for the output of a command'
+        % COMMAND_PREFIX,
+    )
+    parser.add_argument("-format", **LOG_CONFIG_ARG)
+    parser.add_argument(
+        "-analysis",
+        action="append",
+        choices=analyse_logs.ANALYSES,
+        help="Analysis to perform on each source (can be used multiple times). Defaults to deltas and firstlast",
+    )
+    parser.add_argument(
+        "-follow",
+        action="store_true",
+        help="Wait for new lines at the end of files",
+    )
+    parser.add_argument(
+        "-duration",
+        type=float,
+        help="Duration (in s) after which sources are no longer read. Defaults to no limit",
+    )
+    parser.add_argument(
+        "-queue-size",
+        default=DEFAULT_QUEUE_SIZE,
+        type=int,
+        help="Maximum number of lines waiting to be analysed for each source. Defaults to %d"
+        % DEFAULT_QUEUE_SIZE,
+    )
+    parser.add_argument(
+        "-detection-lines",
+        default=DEFAULT_DETECTION_LINES,
+        type=int,
+        help="Number of lines used to detect the format of each source. Defaults to %d"
+        % DEFAULT_DETECTION_LINES,
+    )
+    deltime_logs.add_arguments(parser)
+    log_smart_compare.add_extraction_arguments(parser)
+
+    # Get arguments
+    args = parser.parse_args()
+
+    def get_analyses(name, log_type):
+        analysis_names = analyse_logs.get_analysis_names(
+            name, log_type, args.analysis, ["deltas", "firstlast"]
+        )
+        return analyse_logs.get_analyses(name, log_type, analysis_names, args)
+
+    # Do process
+    nb_failures = asyncio.run(
+        ingest(
+            args.sources,
+            args.format,
+            get_analyses,
+            args.follow,
+            args.duration,
+            args.queue_size,
+            args.detection_lines,
+        )
+    )
+    if nb_failures:
+        sys.exit(1)
@@ -0,0 +1,394 @@
+"""
+This module is used to compare folders produced by log_smart_compare without
+relying on an external diff tool.
+Files with the same relative path (groups) in the different folders are compared:
+ - groups with the same content are detected with a digest and skipped
+ - other groups are diffed on integer line identifiers, exactly for small
+   groups and around anchors (patience and histogram diffs) for large ones
+The result is a summary ranking the groups which differ the most.
+"""
+
+import os
+import hashlib
+import json
+import bisect
+
+# Maximum product of the lengths of ranges compared with an exact LCS
+MAX_LCS_CELLS = 10**8
+# Sizes of the runs of consecutive lines tried in turn as unique anchors
+ANCHOR_RUN_SIZES = (1, 2, 4, 8)
+# Lines occurring more often than this in a range are not used as anchors
+MAX_ANCHOR_OCCURRENCES = 64
+# Maximum number of steps of the diff used when no line can be an anchor
+MAX_DIFF_STEPS = 1000000
+
+
+def get_group_files(folder):
+    """Get a dictionnary mapping relative path of each file in folder to its full path."""
+    group_files = dict()
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            group_files[os.path.relpath(path, folder)] = path
+    return group_files
+
+
+def get_file_digest(path):
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def get_line_ids(path, line_ids):
+    """Get lines from file as integers, identical lines sharing the same identifier."""
+    with open(path, "rb") as f:
+        return [line_ids.setdefault(line, len(line_ids)) for line in f]
+
+
+def get_lcs_length(a, alo, ahi, b, blo, bhi):
+    """Get length of the longest common subsequence of the ranges.
+
+    The bit-parallel algorithm handles a whole column of the dynamic
+    programming table at once with integers used as bit vectors."""
+    masks = dict()
+    for j in range(blo, bhi):
+        masks[b[j]] = masks.get(b[j], 0) | (1 << (j - blo))
+    all_ones = (1 << (bhi - blo)) - 1
+    v = all_ones
+    for i in range(alo, ahi):
+        u = v & masks.get(a[i], 0)
+        v = ((v + u) | (v - u)) & all_ones
+    # Each zero bit is a line of the common subsequence
+    return bhi - blo - v.bit_count()
+
+
+def get_run_keys(lines, lo, hi, size):
+    """Get keys identifying each run of size consecutive lines in the range."""
+    if size == 1:
+        return lines[lo:hi]
+    return [tuple(lines[i : i + size]) for i in range(lo, hi - size + 1)]
+
+
+def get_unique_common_anchors(a, alo, ahi, b, blo, bhi, size=1):
+    """Get longest sequence of pairs of indices of runs of lines appearing once in both ranges."""
+    keys_a = get_run_keys(a, alo, ahi, size)
+    keys_b = get_run_keys(b, blo, bhi, size)
+    index_a = dict()
+    for i, key in enumerate(keys_a):
+        index_a[key] = -1 if key in index_a else i
+    index_b = dict()
+    for j, key in enumerate(keys_b):
+        index_b[key] = -1 if key in index_b else j
+    pairs = [
+        (alo + i, blo + index_b[key])
+        for i, key in enumerate(keys_a)
+        if index_a[key] == i and index_b.get(key, -1) >= 0
+    ]
+    # Longest increasing subsequence on indices from b (patience sorting)
+    top_values = []
+    top_indices = []
+    previous = []
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(top_values, j)
+        previous.append(top_indices[pos - 1] if pos else -1)
+        if pos == len(top_values):
+            top_values.append(j)
+            top_indices.append(k)
+        else:
+            top_values[pos] = j
+            top_indices[pos] = k
+    anchors = []
+    k = top_indices[-1] if top_indices else -1
+    while k >= 0:
+        anchors.append(pairs[k])
+        k = previous[k]
+    return anchors[::-1]
+
+
+def get_histogram_anchor(a, alo, ahi, b, blo, bhi):
+    """Get longest common region (i, j, size) around lines occurring the least in the range of a.
+
+    Only lines occurring at most MAX_ANCHOR_OCCURRENCES times are considered:
+    None is returned if there is no such common line."""
+    positions = dict()
+    for i in range(alo, ahi):
+        positions.setdefault(a[i], []).append(i)
+    best_i, best_j, best_size = 0, 0, 0
+    best_count = MAX_ANCHOR_OCCURRENCES
+    j = blo
+    while j < bhi:
+        next_j = j + 1
+        occurrences = positions.get(b[j], ())
+        if len(occurrences) <= best_count:
+            for i in occurrences:
+                # Extend region in both directions, counting its rarest line
+                count = len(occurrences)
+                si, sj = i, j
+                while si > alo and sj > blo and a[si - 1] == b[sj - 1]:
+                    si, sj = si - 1, sj - 1
+                    count = min(count, len(positions[a[si]]))
+                ei, ej = i + 1, j + 1
+                while ei < ahi and ej < bhi and a[ei] == b[ej]:
+                    count = min(count, len(positions[a[ei]]))
+                    ei, ej = ei + 1, ej + 1
+                if ei - si > best_size or count < best_count:
+                    best_i, best_j, best_size = si, sj, ei - si
+                    best_count = count
+                next_j = max(next_j, ej)
+        j = next_j
+    return (best_i, best_j, best_size) if best_size else None
+
+
+def count_diff_matching_lines(a, alo, ahi, b, blo, bhi, max_steps=MAX_DIFF_STEPS):
+    """Count lines kept unchanged by a Myers diff between the ranges.
+
+    Only the number of edits is computed so that memory is linear. If the
+    number of steps exceeds max_steps, the lines matched by the best partial
+    path are returned, which is a lower bound."""
+    n, m = ahi - alo, bhi - blo
+    # Furthest x reached on each diagonal k = x - y
+    furthest = {1: 0}
+    best = 0
+    steps = 0
+    for d in range(n + m + 1):
+        for k in range(max(-d, -m), min(d, n) + 1):
+            if (k + d) % 2:
+                continue
+            x = -1
+            if k + 1 in furthest and furthest[k + 1] - k - 1 < m:
+                x = furthest[k + 1]
+            if k - 1 in furthest and furthest[k - 1] < n:
+                x = max(x, furthest[k - 1] + 1)
+            if x < 0:
+                continue
+            y = x - k
+            start = x
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x, y = x + 1, y + 1
+            furthest[k] = x
+            steps += 1 + x - start
+            if x == n and y == m:
+                return (n + m - d) // 2
+            best = max(best, (x + y - d) // 2)
+        if steps > max_steps:
+            return best
+    return best
+
+
+def count_matching_lines(a, b):
+    """Count lines kept unchanged by a diff between the 2 sequences.
+
+    Small ranges are compared with an exact LCS. Larger ones are split around
+    anchors: lines appearing once in both ranges (patience diff), or runs of
+    consecutive lines appearing once when lines repeat, otherwise the longest
+    region around the rarest lines (histogram diff). Ranges without any rare
+    line fallback to a Myers diff."""
+    matched = 0
+    ranges = [(0, len(a), 0, len(b))]
+    while ranges:
+        alo, ahi, blo, bhi = ranges.pop()
+        # Skip common prefix and suffix
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo, blo, matched = alo + 1, blo + 1, matched + 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi, bhi, matched = ahi - 1, bhi - 1, matched + 1
+        if alo == ahi or blo == bhi:
+            continue
+        if (ahi - alo) * (bhi - blo) <= MAX_LCS_CELLS:
+            matched += get_lcs_length(a, alo, ahi, b, blo, bhi)
+            continue
+        for size in ANCHOR_RUN_SIZES:
+            anchors = get_unique_common_anchors(a, alo, ahi, b, blo, bhi, size)
+            if anchors:
+                break
+        if anchors:
+            for i, j in anchors:
+                # Skip runs overlapping the previous one
+                if i < alo or j < blo:
+                    continue
+                ranges.append((alo, i, blo, j))
+                alo, blo, matched = i + size, j + size, matched + size
+            ranges.append((alo, ahi, blo, bhi))
+            continue
+        anchor = get_histogram_anchor(a, alo, ahi, b, blo, bhi)
+        if anchor is None:
+            matched += count_diff_matching_lines(a, alo, ahi, b, blo, bhi)
+            continue
+        i, j, size = anchor
+        matched += size
+        ranges.append((alo, i, blo, j))
+        ranges.append((i + size, ahi, j + size, bhi))
+    return matched
+
+
+def compare_folders(reference, compared):
+    """Compare 2 folders - return a dictionnary summing up the differences."""
+    ref_files = get_group_files(reference)
+    cmp_files = get_group_files(compared)
+    only_in_reference = []
+    only_in_compared = []
+    different = []
+    identical = 0
+    for group in sorted(ref_files.keys() | cmp_files.keys()):
+        ref_path, cmp_path = ref_files.get(group), cmp_files.get(group)
+        if cmp_path is None:
+            only_in_reference.append({"group": group, "lines": count_lines(ref_path)})
+        elif ref_path is None:
+            only_in_compared.append({"group": group, "lines": count_lines(cmp_path)})
+        elif os.path.getsize(ref_path) == os.path.getsize(
+            cmp_path
+        ) and get_file_digest(ref_path) == get_file_digest(cmp_path):
+            identical += 1
+        else:
+            line_ids = dict()
+            a = get_line_ids(ref_path, line_ids)
+            b = get_line_ids(cmp_path, line_ids)
+            matched = count_matching_lines(a, b)
+            different.append(
+                {
+                    "group": group,
+                    "removed": len(a) - matched,
+                    "added": len(b) - matched,
+                }
+            )
+    for lst, key in (
+        (only_in_reference, lambda g: g["lines"]),
+        (only_in_compared, lambda g: g["lines"]),
+        (different, lambda g: g["removed"] + g["added"]),
+    ):
+        lst.sort(key=key, reverse=True)
+    return {
+        "reference": reference,
+        "compared": compared,
+        "identical": identical,
+        "only_in_reference": only_in_reference,
+        "only_in_compared": only_in_compared,
+        "different": different,
+    }
+
+
+def print_text_report(summary, limit):
+    print()
+    print("Comparing %s with %s" % (summary["reference"], summary["compared"]))
+    print("%d identical groups" % summary["identical"])
+    for title, key in (
+        ("only in reference", "only_in_reference"),
+        ("only in compared", "only_in_compared"),
+    ):
+        groups = summary[key]
+        print("%d groups %s" % (len(groups), title))
+        for g in groups[:limit]:
+            print("  %8d lines  %s" % (g["lines"], g["group"]))
+    groups = summary["different"]
+    print("%d groups with differences" % len(groups))
+    for g in groups[:limit]:
+        print("  -%-7d +%-7d %s" % (g["removed"], g["added"], g["group"]))
+
+
+def report_differences(folders, output_format="text", limit=20):
+    """Compare each folder with the first one and print summary."""
+    summaries = [compare_folders(folders[0], folder) for folder in folders[1:]]
+    if output_format == "json":
+        print(json.dumps(summaries, indent=2))
+    else:
+        for summary in summaries:
+            print_text_report(summary, limit)
+
+
+# TESTS
+#########################################
+def get_brute_force_lcs_length(a, b):
+    """Get length of the longest common subsequence with dynamic programming."""
+    lengths = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b):
+            previous, lengths[j + 1] = lengths[j + 1], (
+                previous + 1 if x == y else max(lengths[j + 1], lengths[j])
+            )
+    return lengths[-1]
+
+
+def get_edited_lines(rand, lines, nb_edits, nb_values):
+    """Get copy of lines with lines removed, added or replaced at random."""
+    edited = list(lines)
+    for _ in range(nb_edits):
+        i = rand.randrange(len(edited) + 1)
+        action = rand.randrange(3)
+        if action < 2 and i < len(edited):
+            del edited[i]
+        if action > 0:
+            edited.insert(i, rand.randrange(nb_values))
+    return edited
+
+
+def test_count_matching_lines():
+    print("test_count_matching_lines")
+    import random
+
+    global MAX_LCS_CELLS
+    rand = random.Random(0)
+    max_lcs_cells = MAX_LCS_CELLS
+    try:
+        for _ in range(300):
+            nb_values = rand.choice([3, 6, 50])
+            a = [rand.randrange(nb_values) for _ in range(rand.randrange(60))]
+            if rand.randrange(2):
+                b = get_edited_lines(rand, a, rand.randrange(10), nb_values)
+            else:
+                b = [rand.randrange(nb_values) for _ in range(rand.randrange(60))]
+            lcs_length = get_brute_force_lcs_length(a, b)
+            # Exact LCS on small ranges
+            MAX_LCS_CELLS = max_lcs_cells
+            assert count_matching_lines(a, b) == lcs_length, (a, b)
+            # Diff used without rare lines
+            assert count_diff_matching_lines(a, 0, len(a), b, 0, len(b)) == lcs_length
+            # Anchors only
+            MAX_LCS_CELLS = 0
+            assert count_matching_lines(a, b) <= lcs_length, (a, b)
+            assert count_matching_lines(a, a) == len(a), a
+    finally:
+        MAX_LCS_CELLS = max_lcs_cells
+    # Frequent lines must not be ignored
+    assert count_matching_lines(["x", "y"] * 300, ["y", "x"] * 300) == 599
+    # Large ranges with repeated lines are split around anchors
+    a = [rand.randrange(50) for _ in range(30000)]
+    b = get_edited_lines(rand, a, 100, 50)
+    assert count_matching_lines(a, b) >= len(a) - 100
+
+
+def test_compare_folders():
+    print("test_compare_folders")
+    import tempfile
+
+    reference_files = {"same": "a\nb\n", "changed": "a\nb\nc\n", "removed": "a\n"}
+    compared_files = {"same": "a\nb\n", "changed": "a\nc\nd\ne\n", "added": "a\nb\n"}
+    with tempfile.TemporaryDirectory() as reference, tempfile.TemporaryDirectory() as compared:
+        for folder, files in ((reference, reference_files), (compared, compared_files)):
+            os.mkdir(folder + "/sub")
+            for name, content in files.items():
+                with open(folder + "/sub/" + name, "w") as f:
+                    f.write(content)
+        summary = compare_folders(reference, compared)
+        assert summary["identical"] == 1, summary
+        assert summary["only_in_reference"] == [
+            {"group": os.path.join("sub", "removed"), "lines": 1}
+        ], summary
+        assert summary["only_in_compared"] == [
+            {"group": os.path.join("sub", "added"), "lines": 2}
+        ], summary
+        assert summary["different"] == [
+            {"group": os.path.join("sub", "changed"), "removed": 1, "added": 2}
+        ], summary
+
+
+if __name__ == "__main__":
+    test_count_matching_lines()
+    test_compare_folders()
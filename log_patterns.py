@@ -0,0 +1,286 @@
+"""
+This module is used to find which relevant patterns match log lines, the
+patterns being provided by the user as literal strings or regexps, possibly
+grouped in named sets.
+Most patterns are merged in a single prefilter regexp so that lines without
+any match, usually the vast majority, are scanned once whatever the number of
+patterns.
+"""
+import re
+
+# Characters which prevent a pattern from being handled as a literal string
+REGEX_SPECIAL_CHARS = set(".^$*+?{}[]\\|()")
+# Patterns referring to their own groups can not be merged with other patterns
+GROUP_REFERENCE_PATTERN = r"\\[1-9]|\(\?P=|\(\?\("
+# Line defining the name of the set the next patterns belong to in a file
+SET_HEADER_PATTERN = r"\[([^\[\]]+)\]:$"
+
+
+def fold_char(c):
+    """Get the form shared by characters matching each other when case is ignored."""
+    lower = c.lower()[0]
+    # Going through upper case joins characters like "µ" and "μ"
+    upper = lower.upper()
+    return upper.lower()[0] if len(upper) == 1 else lower
+
+
+def fold_case(string):
+    if string.isascii():
+        return string.lower()
+    return "".join(fold_char(c) for c in string)
+
+
+def check_pattern(pattern):
+    """Raise a ValueError if pattern is not a valid regexp."""
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        raise ValueError("invalid pattern %r: %s" % (pattern, e)) from e
+
+
+def is_literal(pattern):
+    return not any(c in REGEX_SPECIAL_CHARS for c in pattern)
+
+
+def can_be_merged(compiled):
+    """Check if regexp can be spliced into a regexp made of several patterns.
+
+    It is not the case for regexps with global inline flags, which must be at
+    the start, named groups, whose names could clash, and back-references,
+    whose group numbers would change."""
+    return (
+        not compiled.flags & ~re.UNICODE
+        and not compiled.groupindex
+        and not re.search(GROUP_REFERENCE_PATTERN, compiled.pattern)
+    )
+
+
+def split_literal_prefix(pattern):
+    """Split pattern into a literal prefix and the rest of the regexp."""
+    if "|" in pattern:
+        return "", pattern
+    for i, c in enumerate(pattern):
+        if c in REGEX_SPECIAL_CHARS:
+            # Quantifiers apply to the previous character
+            if c in "*+?{":
+                i = max(i - 1, 0)
+            return pattern[:i], pattern[i:]
+    return pattern, ""
+
+
+def get_trie_regex(split_patterns):
+    """Get regexp matching any of the (literal prefix, rest of regexp) provided.
+
+    The regexp is built from the prefix tree of the literal prefixes:
+    alternatives sharing a prefix are factorised so that the regexp engine
+    does not try each pattern in turn at each position."""
+    trie = dict()
+    for prefix, rest in split_patterns:
+        node = trie
+        for c in fold_case(prefix):
+            node = node.setdefault(c, dict())
+        node.setdefault("", set()).add(rest)
+
+    def trie_to_regex(node):
+        alternatives = [
+            re.escape(c) + trie_to_regex(child)
+            for c, child in sorted(node.items())
+            if c
+        ]
+        # Prefer longest match: empty rest (end of literal) is tried last
+        ends = sorted(node.get("", ()), reverse=True)
+        alternatives.extend("(?:%s)" % rest if rest else "" for rest in ends)
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:%s)" % "|".join(alternatives)
+
+    return trie_to_regex(trie)
+
+
+class PatternMatcher:
+    """Find which named patterns match a line.
+
+    Patterns sharing the same name are handled as a set: the name is returned
+    when any of them matches. Patterns are merged in a prefilter regexp
+    without capturing groups, built from the prefix tree of their literal
+    prefixes, so that lines without any match are rejected in a single scan.
+    On lines with a match, literal strings and literal prefixes of regexps
+    are all found at once with a lookahead at each position: literal strings
+    found give their names directly and only regexps whose prefix was found
+    are checked. Regexps which can not be merged are checked individually."""
+
+    def __init__(self, named_patterns):
+        # Names and regexps for each literal string (case folded) found in lines
+        self.names_by_key = dict()
+        self.regexps_by_key = dict()
+        # Literal strings and regexps with a literal prefix, as regexps
+        self.keyed_regexps = []
+        # Regexps without literal prefix, checked whenever the prefilter matches
+        self.unprefixed_regexps = []
+        # Regexps which can not be merged, checked on each line
+        self.individual_regexps = []
+        merged = []
+        for name, pattern in named_patterns:
+            check_pattern(pattern)
+            compiled = re.compile(pattern, re.IGNORECASE)
+            if is_literal(pattern):
+                self.names_by_key.setdefault(fold_case(pattern), set()).add(name)
+                self.keyed_regexps.append((name, compiled))
+            elif can_be_merged(re.compile(pattern)):
+                prefix = fold_case(split_literal_prefix(pattern)[0])
+                if prefix:
+                    regexps = self.regexps_by_key.setdefault(prefix, [])
+                    regexps.append((name, compiled))
+                    self.keyed_regexps.append((name, compiled))
+                else:
+                    self.unprefixed_regexps.append((name, compiled))
+            else:
+                self.individual_regexps.append((name, compiled))
+                continue
+            merged.append(pattern)
+        self.nb_names = len(set(name for name, _ in named_patterns))
+        self.prefilter = self.keys_finder = None
+        if merged:
+            self.prefilter = re.compile(
+                get_trie_regex(split_literal_prefix(pattern) for pattern in merged),
+                re.IGNORECASE,
+            )
+        keys = self.names_by_key.keys() | self.regexps_by_key.keys()
+        if keys:
+            # Lookahead matches at each position, the longest key being captured
+            self.keys_finder = re.compile(
+                "(?=(%s))" % get_trie_regex((key, "") for key in keys),
+                re.IGNORECASE,
+            )
+        # Shorter keys found at the same position are prefixes of the longest key
+        self.names_by_longest_key = dict()
+        self.regexps_by_longest_key = dict()
+        for key in keys:
+            prefixes = [key[:i] for i in range(1, len(key) + 1)]
+            self.names_by_longest_key[key] = set().union(
+                *(self.names_by_key.get(p, ()) for p in prefixes)
+            )
+            self.regexps_by_longest_key[key] = [
+                r for p in prefixes for r in self.regexps_by_key.get(p, ())
+            ]
+
+    def get_matching_names(self, line):
+        names = set()
+        if self.prefilter is not None and self.prefilter.search(line):
+            candidates = list(self.unprefixed_regexps)
+            if self.keys_finder is not None:
+                found = self.keys_finder.finditer(line)
+                for key in set(fold_case(m.group(1)) for m in found):
+                    if key not in self.names_by_longest_key:
+                        # Check all patterns rather than missing one
+                        candidates.extend(self.keyed_regexps)
+                        continue
+                    names.update(self.names_by_longest_key[key])
+                    candidates.extend(self.regexps_by_longest_key[key])
+            for name, pat_re in candidates:
+                if name not in names and pat_re.search(line):
+                    names.add(name)
+        for name, pat_re in self.individual_regexps:
+            if len(names) == self.nb_names:
+                break
+            if name not in names and pat_re.search(line):
+                names.add(name)
+        return names
+
+
+def read_patterns_file(filename):
+    """Read named patterns from a file - return a list of (name, pattern).
+
+    Each non-empty line is a pattern, named after itself unless it follows a
+    "[name]:" line defining a named set of patterns. Lines starting with "#"
+    are ignored. A pattern looking like a set header or a comment can be
+    written with an escaped character ("[A-Z]\\:" or "\\#")."""
+    named_patterns = []
+    name = None
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            m = re.match(SET_HEADER_PATTERN, line)
+            if m:
+                name = m.group(1)
+            else:
+                named_patterns.append((line if name is None else name, line))
+    return named_patterns
+
+
+# TESTS
+#########################################
+def test_pattern_matcher():
+    print("test_pattern_matcher")
+    import random
+
+    rand = random.Random(0)
+    patterns = [
+        "error",
+        "err",
+        "rror",
+        "Timeout",
+        "time",
+        "fail(ed|ure)",
+        "failed",
+        "[0-9]+ms",
+        r"\d+ ?ms]",
+        "b.*d",
+        "a|z",
+        "(?i)OOM",
+        r"(a)\1",
+        "(?P<x>ab)c",
+        "(?P<x>cd)e",
+        "e{2,}",
+        "^start",
+        "μs",
+        "ß",
+        "İd",
+        "k",
+    ]
+    words = ["error", "time", "out", "fail", "ed", "ure", "12", "ms]", "aa", "abc"]
+    words += ["cde", "oom", "start", "b", "d", "e", " ", "µs", "μS", "SS", "ß"]
+    words += ["İ", "i", "K", "\u212a"]
+    for _ in range(300):
+        named_patterns = [
+            (rand.choice("ABCDEFGH"), p)
+            for p in rand.sample(patterns, rand.randrange(1, len(patterns)))
+        ]
+        matcher = PatternMatcher(named_patterns)
+        for _ in range(20):
+            line = "".join(rand.choice(words) for _ in range(rand.randrange(8)))
+            expected = set(
+                name
+                for name, pattern in named_patterns
+                if re.search(pattern, line, re.IGNORECASE)
+            )
+            names = matcher.get_matching_names(line)
+            assert names == expected, (named_patterns, line, names, expected)
+    # Text matched case-insensitively with another lower case form
+    assert PatternMatcher([("u", "μs")]).get_matching_names("took 5µs") == {"u"}
+    for i in range(256):
+        c = chr(i)
+        assert re.fullmatch(re.escape(c), fold_char(c), re.IGNORECASE), c
+
+
+def test_read_patterns_file():
+    print("test_read_patterns_file")
+    import tempfile
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+        f.write("# comment\nalone\n\n[errors]:\nerror\n[0-9]+ms]\n[A-Z]\n[A-Z]\\:\n")
+        f.flush()
+        assert read_patterns_file(f.name) == [
+            ("alone", "alone"),
+            ("errors", "error"),
+            ("errors", "[0-9]+ms]"),
+            ("errors", "[A-Z]"),
+            ("errors", "[A-Z]\\:"),
+        ], read_patterns_file(f.name)
+
+
+if __name__ == "__main__":
+    test_pattern_matcher()
+    test_read_patterns_file()
@@ -3,55 +3,56 @@ This script is used to compare log files which are usually hard to compare for v
  - some data should not be compared (timestamps, thread identifiers, etc)
  - irrelevant events in the wrong order mess up with the diff
 Hence, the script tries to get the relevant data and stores them with a clean format in a well defined file hierarchy.
-Then, the output folders can be compared with a proper tool such as meld or kompare.
+Then, the output folders can be compared with a proper tool such as meld or kompare
+or summed up with the built-in diff engine from log_diff.
 """
 
 
-import sys
 import re
-import tempfile
 import os
-import subprocess
+import collections
+import functools
+import heapq
+import itertools
+import tempfile
 
-import log_types
+import log_templates
+from log_patterns import PatternMatcher, check_pattern, read_patterns_file
 from log_types import (
     LOG_TYPES,
+    LOG_CONFIGS,
     LOG_CONFIG_ARG,
+    open_log,
+    open_log_file,
     get_log_config_from_arg,
-    UlogcatLongLogType,
-    UlogcatShortLogType,
-    LogcatLogType,
-    LogcatFromPctsFileLogType,
-    DmesgDefaultLogType,
-    DmesgHumanTimestampsLogType,
-    DmesgRawLogType,
-    JenkinsLogType,
-    JournalCtlLogType,
-    SysLogLogType,
-    RawLogType,
-    ZazuSocLogType,
-    PctsLogTypes,
+    get_field_names,
+    get_match_counts,
+    get_best_log_types,
+    choose_detected_log_type,
+    get_cached_log_type,
+    set_cached_log_type,
+    iter_parsed_lines,
+    UnmatchedReport,
+    analyse_file,
 )
 
 
-# Add information about the output format to the log types
-UlogcatLongLogType.output_format = (
-    "DATE {level} {tag} ({processname}-PID/{threadname}-TID): {clean_content}"
-)
-UlogcatShortLogType.output_format = "{level} {tag} ({processname}): {clean_content}"
-LogcatLogType.output_format = "DATE PID TID {level} {tag} {clean_content}"
-LogcatFromPctsFileLogType.output_format = "DATE {level} {tag} TID {clean_content}"
-ZazuSocLogType.output_format = "DATE {level} {tag} ({processname}): {clean_content}"
-DmesgDefaultLogType.output_format = "DATE {processid} {clean_content}"
-DmesgHumanTimestampsLogType.output_format = "DATE {processid} {clean_content}"
-DmesgRawLogType.output_format = "DATE {processid} {clean_content}"
-JenkinsLogType.output_format = "DATE {content}"
-JournalCtlLogType.output_format = (
-    "DATE {hostname} {processname} {processid} {clean_content}"
-)
-SysLogLogType.output_format = "DATE {hostname} {processname} {clean_content}"
-PctsLogTypes.output_format = "DATE {level} {clean_content}"
-RawLogType.output_format = "{clean_content}"
+# Information about the output format for each log type
+OUTPUT_FORMATS = {
+    "ulogcat": "DATE {level} {tag} ({processname}-PID/{threadname}-TID): {clean_content}",
+    "ulogcat_short": "{level} {tag} ({processname}): {clean_content}",
+    "logcat": "DATE PID TID {level} {tag} {clean_content}",
+    "logcatpcts": "DATE {level} {tag} TID {clean_content}",
+    "zazusoc": "DATE {level} {tag} ({processname}): {clean_content}",
+    "dmesg": "DATE {processid} {clean_content}",
+    "dmesg_humantime": "DATE {processid} {clean_content}",
+    "dmesg_raw": "DATE {processid} {clean_content}",
+    "jenkins": "DATE {content}",
+    "journalctl": "DATE {hostname} {processname} {processid} {clean_content}",
+    "syslog": "DATE {hostname} {processname} {clean_content}",
+    "pcts": "DATE {level} {clean_content}",
+    "raw": "{clean_content}",
+}
 
 grouped_values = {
     "processthreadnames": ("processname", "threadname"),
@@ -98,96 +99,553 @@ cleanup_functions = {
     "content": (clean_content, "clean_content"),
 }
 
-# Relevant patterns - currently hardcoded - to be configurable in the future
-patterns = []
-# Make the list into a more usable structure: a dict mapping strings to compiled
-# regexp which also includes a combinations of all regexps
-patterns = {p: p for p in patterns}
-patterns["ALL"] = "|".join(pat_re for pat_re in patterns)
-patterns = {k: re.compile(v, re.IGNORECASE) for k, v in patterns.items()}
+# Suffix for the keys grouping lines in sorted order
+SORTED_SUFFIX = "_sorted"
+
+def iter_line_groups(line, fields, log_type, pattern_matcher=None, template_miner=None):
+    """Yield (group key, group value, line) for each group a parsed line belongs to."""
+    if fields is None:
+        yield "ALL", "nomatch", line
+    else:
+        d = dict(fields)
+        for field, (func, clean_field) in cleanup_functions.items():
+            val = d.get(field)
+            if val is not None:
+                d[clean_field] = func(d[field])
+        out_line = OUTPUT_FORMATS[log_type.name].format(**d)
+        if template_miner is not None:
+            template_miner.add(d.get("clean_content", out_line))
+        for group_name, group_values in grouped_values.items():
+            if all(v in d for v in group_values):
+                d[group_name] = "_".join(str(d[v]) for v in group_values)
+        for k, v in d.items():
+            yield k, v, out_line
+        yield "ALL", "clean", out_line
+        if pattern_matcher is not None:
+            pat_names = pattern_matcher.get_matching_names(line)
+            for pat_name in sorted(pat_names):
+                yield "patterns", pat_name, out_line
+            if pat_names:
+                yield "patterns", "ALL", out_line
+    yield "ALL", "original", line
+
+
+def iter_grouped_lines(
+    f, log_type, pattern_matcher=None, template_miner=None, unmatched_report=None
+):
+    """Parse file and yield (group key, group value, line) for each group a line belongs to."""
+    for line, fields in iter_parsed_lines(f, log_type, unmatched_report):
+        yield from iter_line_groups(
+            line, fields, log_type, pattern_matcher, template_miner
+        )
+
+
+# Key for the table of templates mined from the lines with their counts
+TEMPLATE_KEY = "template"
+
+
+def get_template_miner(group_keys):
+    if TEMPLATE_KEY in group_keys or TEMPLATE_KEY + SORTED_SUFFIX in group_keys:
+        return log_templates.TemplateMiner()
+    return None
+
+
+def get_template_count_lines(template_miner):
+    counts = template_miner.get_template_counts()
+    return ["%8d %s" % (counts[t], t) for t in sorted(counts)]
 
 
-def extract_data(f, log_type):
+def extract_data(f, log_type, pattern_matcher=None, template_miner=None):
     """Extract relevant data from file - return a dictionnary."""
-    log_re = re.compile(log_type.regex)
-    out_format = log_type.output_format
     bigdict = dict()
     dict_all = bigdict.setdefault("ALL", dict())
-    clean_lst = dict_all.setdefault("clean", [])
-    original_lst = dict_all.setdefault("original", [])
-    no_match = dict_all.setdefault("nomatch", [])
-    patterns_list = bigdict.setdefault("patterns", dict())
-    for line in f:
-        line = line.strip()
-        if line:
-            m = log_re.match(line)
-            if m is None:
-                no_match.append(line)
-            else:
-                d = m.groupdict()
-                for field, (func, clean_field) in cleanup_functions.items():
-                    val = d.get(field)
-                    if val is not None:
-                        d[clean_field] = func(d[field])
-                out_line = out_format.format(**d)
-                for group_name, group_values in grouped_values.items():
-                    if all(v in d for v in group_values):
-                        d[group_name] = "_".join(str(d[v]) for v in group_values)
-                for k, v in d.items():
-                    bigdict.setdefault(k, dict()).setdefault(v, []).append(out_line)
-                clean_lst.append(out_line)
-                for pat_name, pat_re in patterns.items():
-                    if pat_re.search(line):
-                        patterns_list.setdefault(pat_name, []).append(out_line)
-            original_lst.append(line)
-    if no_match:
-        log = "%s lines from %s did not match (out of %s):" % (
-            len(no_match),
-            f.name,
-            len(original_lst),
-        )
-        print(log)
-        for line in no_match:
-            print("  '" + line + "'")
-        print(log)
+    for k in ("clean", "original", "nomatch"):
+        dict_all.setdefault(k, [])
+    bigdict.setdefault("patterns", dict())
+    unmatched_report = UnmatchedReport(log_type)
+    lines = iter_grouped_lines(
+        f, log_type, pattern_matcher, template_miner, unmatched_report
+    )
+    for k, v, line in lines:
+        bigdict.setdefault(k, dict()).setdefault(v, []).append(line)
+    unmatched_report.print_report(f.name, len(dict_all["original"]))
+    if template_miner is not None:
+        bigdict[TEMPLATE_KEY] = {"counts": get_template_count_lines(template_miner)}
     # Add sorted content
     for k, v in list(bigdict.items()):
         sorted_dict = dict()
-        bigdict[k + "_sorted"] = sorted_dict
+        bigdict[k + SORTED_SUFFIX] = sorted_dict
         for k2, v2 in v.items():
             sorted_dict[k2] = sorted(v2)
     return bigdict
 
 
-def store_relevant_data_in_a_tmp_folder(f, log_type, group_keys):
+def get_group_filename(tmpdir, k, value):
+    """Get name of the file storing lines for a given value of the group key."""
+    cleanval = "".join(c if c.isalnum() else "_" for c in str(value))
+    return "%s/%s/%s_%s.txt" % (tmpdir, k, k, cleanval)
+
+
+def store_relevant_data_in_a_tmp_folder(
+    f, log_type, group_keys, pattern_matcher=None
+):
     """Store relevant data from file provided into a tmp folder."""
     # Extract relevant data from file
-    bigdict = extract_data(f, log_type)
+    template_miner = get_template_miner(group_keys)
+    bigdict = extract_data(f, log_type, pattern_matcher, template_miner)
     # Store data in multiple files in a temporary folder
     tmpdir = tempfile.mkdtemp()
     print("%s analysed in %s" % (f.name, tmpdir))
     for k in group_keys:
         if k in bigdict:
-            newdir = tmpdir + "/" + k
-            os.mkdir(newdir)
+            os.mkdir(tmpdir + "/" + k)
             for value, lines in bigdict[k].items():
-                cleanval = "".join(c if c.isalnum() else "_" for c in str(value))
-                newfile = "%s/%s_%s.txt" % (newdir, k, cleanval)
-                with open(newfile, "x") as file2:
+                with open(get_group_filename(tmpdir, k, value), "x") as file2:
                     for line in lines:
                         file2.write(line + "\n")
     return tmpdir
 
 
-def compare_files(files, log_type, group_keys, difftool):
-    """Compare files by storing relevant data into a file hierarchy compared by a dedicated tool."""
+# Streaming mode
+#########################################
+# Maximum number of group files kept open at the same time
+DEFAULT_MAX_OPEN_FILES = 256
+# Size of the write buffer for each open group file
+FILE_BUFFER_SIZE = 16 * 1024
+# Number of lines sorted in memory for each run of the external merge sort
+SORT_CHUNK_SIZE = 100000
+# Maximum number of runs merged at once by the external merge sort
+SORT_MAX_RUNS = 64
+
+
+class FilePool:
+    """Bounded pool of files opened in append mode, closing the least recently used first."""
+
+    def __init__(self, max_open_files):
+        self.max_open_files = max_open_files
+        self.files = collections.OrderedDict()
+
+    def write(self, path, data):
+        f = self.files.get(path)
+        if f is None:
+            if len(self.files) >= self.max_open_files:
+                _, oldest = self.files.popitem(last=False)
+                oldest.close()
+            f = self.files[path] = open(path, "a", buffering=FILE_BUFFER_SIZE)
+        else:
+            self.files.move_to_end(path)
+        f.write(data)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+def get_line_sort_key(line):
+    # Ignore final newline so that order is the same as for in-memory sort
+    return line[:-1]
+
+
+def merge_runs(runs, output):
+    output.writelines(heapq.merge(*runs, key=get_line_sort_key))
+    for run in runs:
+        run.close()
+
+
+def sort_file_in_place(path, chunk_size=SORT_CHUNK_SIZE, max_runs=SORT_MAX_RUNS):
+    """Sort lines from a file with an external merge sort.
+
+    Chunks of lines are sorted in memory and spilled to temporary files (runs)
+    which are then merged, at most max_runs at a time."""
+    runs = []
+    with open(path) as f:
+        while True:
+            chunk = list(itertools.islice(f, chunk_size))
+            if not chunk:
+                break
+            chunk.sort(key=get_line_sort_key)
+            run = tempfile.TemporaryFile("w+")
+            run.writelines(chunk)
+            run.seek(0)
+            runs.append(run)
+    while len(runs) > max_runs:
+        merged = tempfile.TemporaryFile("w+")
+        merge_runs(runs[:max_runs], merged)
+        merged.seek(0)
+        runs = runs[max_runs:] + [merged]
+    with open(path, "w") as f:
+        merge_runs(runs, f)
+
+
+class CompareFolderAnalysis:
+    """Analysis storing relevant data into a tmp folder as lines are parsed, to be used with analyse_file.
+
+    Memory usage does not depend on the size of the file: only a bounded number
+    of files are kept open and sorted groups are sorted with an external merge sort."""
+
+    def __init__(
+        self,
+        name,
+        log_type,
+        group_keys,
+        max_open_files=DEFAULT_MAX_OPEN_FILES,
+        pattern_matcher=None,
+    ):
+        self.name = name
+        self.log_type = log_type
+        self.pattern_matcher = pattern_matcher
+        self.tmpdir = tempfile.mkdtemp()
+        # Map keys from parsed data to the folders they are written in
+        self.folders = dict()
+        for k in group_keys:
+            base = k[: -len(SORTED_SUFFIX)] if k.endswith(SORTED_SUFFIX) else k
+            self.folders.setdefault(base, []).append(k)
+        self.get_filename = functools.lru_cache(maxsize=4096)(
+            lambda k, value: get_group_filename(self.tmpdir, k, value)
+        )
+        # Folders already created, to avoid checking the file system for each line
+        self.created_folders = set()
+        # Folders always present in non-streaming mode are created even if empty
+        for k in itertools.chain(
+            self.folders.get("ALL", []), self.folders.get("patterns", [])
+        ):
+            self.make_folder(k)
+        for k in self.folders.get("ALL", []):
+            for value in ("clean", "original", "nomatch"):
+                open(self.get_filename(k, value), "x").close()
+        self.to_sort = set()
+        self.template_miner = get_template_miner(group_keys)
+        self.pool = FilePool(max_open_files)
+
+    def make_folder(self, folder):
+        if folder not in self.created_folders:
+            os.mkdir(self.tmpdir + "/" + folder)
+            self.created_folders.add(folder)
+
+    def add(self, line, fields):
+        for k, v, out_line in iter_line_groups(
+            line, fields, self.log_type, self.pattern_matcher, self.template_miner
+        ):
+            for folder in self.folders.get(k, []):
+                self.make_folder(folder)
+                path = self.get_filename(folder, v)
+                self.pool.write(path, out_line + "\n")
+                if folder != k:
+                    self.to_sort.add(path)
+
+    def finish(self):
+        self.pool.close()
+        for path in self.to_sort:
+            sort_file_in_place(path)
+        # Table of templates only depends on the number of templates
+        if self.template_miner is not None:
+            lines = get_template_count_lines(self.template_miner)
+            for folder in self.folders[TEMPLATE_KEY]:
+                self.make_folder(folder)
+                with open(self.get_filename(folder, "counts"), "x") as file2:
+                    for line in lines if folder == TEMPLATE_KEY else sorted(lines):
+                        file2.write(line + "\n")
+        print("%s analysed in %s" % (self.name, self.tmpdir))
+
+
+def stream_relevant_data_in_a_tmp_folder(
+    f,
+    log_type,
+    group_keys,
+    max_open_files=DEFAULT_MAX_OPEN_FILES,
+    pattern_matcher=None,
+):
+    """Store relevant data from file provided into a tmp folder, writing lines as they are parsed."""
+    analysis = CompareFolderAnalysis(
+        f.name, log_type, group_keys, max_open_files, pattern_matcher
+    )
+    try:
+        analyse_file(f, log_type, [analysis])
+    finally:
+        analysis.pool.close()
+    return analysis.tmpdir
+
+
+# Parallel mode
+#########################################
+
+
+def can_be_processed_in_parallel(files):
+    """Check whether files can be reopened by name in worker processes."""
+    return all(os.path.isfile(f.name) for f in files)
+
+
+def get_match_counts_from_filename(filename):
+    with open_log(filename) as f:
+        return [count for _, count in get_match_counts([list(f)])]
+
+
+def get_log_config_from_arg_in_parallel(log_type_name, files, executor):
+    """Get log configuration, autodetection being performed on each file in a different process.
+
+    Match counts are summed over all files so that the result is the same as
+    for get_log_config_from_arg."""
+    if log_type_name in LOG_CONFIGS:
+        return LOG_CONFIGS[log_type_name]
+    cached = get_cached_log_type(files)
+    if cached is not None:
+        return cached
+    log_types = [log_type for log_type, _ in get_match_counts([])]
+    counts_by_file = executor.map(
+        get_match_counts_from_filename, [f.name for f in files]
+    )
+    match_count = list(zip(log_types, map(sum, zip(*counts_by_file))))
+    used = choose_detected_log_type(get_best_log_types(match_count))
+    set_cached_log_type(files, used)
+    return used
+
+
+def store_relevant_data_from_filename(
+    filename, log_type, group_keys, streaming, max_open_files, pattern_matcher
+):
+    """Store relevant data from file in a tmp folder - return only the name of the folder."""
+    with open_log(filename) as f:
+        if streaming:
+            return stream_relevant_data_in_a_tmp_folder(
+                f, log_type, group_keys, max_open_files, pattern_matcher
+            )
+        return store_relevant_data_in_a_tmp_folder(
+            f, log_type, group_keys, pattern_matcher
+        )
+
+
+# Default number of groups listed in each section of the report
+DEFAULT_REPORT_LIMIT = 20
+
+
+def compare_files(
+    files,
+    log_type,
+    group_keys,
+    difftool,
+    streaming=False,
+    max_open_files=DEFAULT_MAX_OPEN_FILES,
+    executor=None,
+    report=None,
+    report_limit=DEFAULT_REPORT_LIMIT,
+    pattern_matcher=None,
+):
+    """Compare files by storing relevant data into a file hierarchy compared by a dedicated tool.
+
+    If an executor is provided, each file is processed in a different process.
+    If a report format is provided, the built-in diff engine is used instead of the tool."""
     # Store relevant data in /tmp folders
-    tmpdirs = [
-        store_relevant_data_in_a_tmp_folder(f, log_type, group_keys) for f in files
-    ]
+    if executor is not None:
+        nb_files = len(files)
+        tmpdirs = list(
+            executor.map(
+                store_relevant_data_from_filename,
+                [f.name for f in files],
+                [log_type] * nb_files,
+                [group_keys] * nb_files,
+                [streaming] * nb_files,
+                [max_open_files] * nb_files,
+                [pattern_matcher] * nb_files,
+            )
+        )
+    elif streaming:
+        tmpdirs = [
+            stream_relevant_data_in_a_tmp_folder(
+                f, log_type, group_keys, max_open_files, pattern_matcher
+            )
+            for f in files
+        ]
+    else:
+        tmpdirs = [
+            store_relevant_data_in_a_tmp_folder(
+                f, log_type, group_keys, pattern_matcher
+            )
+            for f in files
+        ]
 
     # Compare final directories in /tmp
-    subprocess.run([difftool] + tmpdirs)
+    if report is None:
+        import subprocess
+
+        subprocess.run([difftool] + tmpdirs)
+    else:
+        import shutil
+        import log_diff
+
+        # Folders are only used to build the report
+        try:
+            log_diff.report_differences(tmpdirs, report, report_limit)
+        finally:
+            for tmpdir in tmpdirs:
+                shutil.rmtree(tmpdir)
+
+
+# Command line
+#########################################
+DEFAULT_GROUP_KEYS = [
+    "tag",
+    "threadname",
+    "threadid",
+    "level",
+    "processname",
+    "processid",
+    "processthreadnames",
+    "patterns",
+    "ALL",
+    "ALL_sorted",
+    TEMPLATE_KEY,
+]
+
+
+def positive_int(string):
+    """Argparse type for integers greater than or equal to 1."""
+    value = int(string)
+    if value < 1:
+        raise ValueError("%d is not a positive integer" % value)
+    return value
+
+
+def relevant_pattern(string):
+    """Argparse type for a relevant pattern."""
+    try:
+        check_pattern(string)
+    except ValueError as e:
+        import argparse
+
+        raise argparse.ArgumentTypeError(str(e))
+    return string
+
+
+def relevant_patterns_file(filename):
+    """Argparse type for a file of relevant patterns - return the list of (name, pattern)."""
+    try:
+        named_patterns = read_patterns_file(filename)
+        for _, pattern in named_patterns:
+            check_pattern(pattern)
+    except (OSError, ValueError) as e:
+        import argparse
+
+        raise argparse.ArgumentTypeError("%s: %s" % (filename, e))
+    return named_patterns
+
+
+def add_extraction_arguments(parser):
+    """Add arguments related to the extraction of relevant data to the argparse parser."""
+    parser.add_argument(
+        "-patterns",
+        action="append",
+        default=[],
+        type=relevant_patterns_file,
+        help='File with relevant patterns (one per line, grouped in named sets by lines "[name]:") used to group lines in the "patterns" folder',
+    )
+    parser.add_argument(
+        "-pattern",
+        action="append",
+        default=[],
+        type=relevant_pattern,
+        help='Relevant pattern used to group lines in the "patterns" folder',
+    )
+    parser.add_argument(
+        "-max-open-files",
+        default=DEFAULT_MAX_OPEN_FILES,
+        type=positive_int,
+        help="Maximum number of output files kept open at the same time in streaming mode. Defaults to %d"
+        % DEFAULT_MAX_OPEN_FILES,
+    )
+    parser.add_argument(
+        "-key",
+        action="append",
+        help="Keys used to group lines in folders. Unavailable values are ignored. Values available depend on the format used: ALL, patterns and %s (counts of templates mined from the lines) for all formats, then %s. Default value: %s."
+        % (
+            TEMPLATE_KEY,
+            ";".join(
+                " for %s: %s"
+                % (log_type.name, ", ".join(get_field_names(log_type)))
+                for log_type in LOG_TYPES
+            ),
+            DEFAULT_GROUP_KEYS,
+        ),
+    )
+
+
+def get_group_keys(args):
+    return DEFAULT_GROUP_KEYS if args.key is None else args.key
+
+
+def get_pattern_matcher(args):
+    named_patterns = [(p, p) for p in args.pattern]
+    for file_patterns in args.patterns:
+        named_patterns.extend(file_patterns)
+    return PatternMatcher(named_patterns)
+
+
+# TESTS
+# Functions without arguments, to be run with: python -m pytest log_smart_compare.py
+#########################################
+def test_sort_file_in_place():
+    print("test_sort_file_in_place")
+    import random
+
+    rand = random.Random(0)
+    lines = ["line %d" % rand.randrange(50) for _ in range(100)] + [""]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = tmpdir + "/lines.txt"
+        with open(path, "w") as f:
+            f.writelines(line + "\n" for line in lines)
+        # Small chunks and runs so that runs are merged in several passes
+        sort_file_in_place(path, chunk_size=7, max_runs=3)
+        with open(path) as f:
+            assert f.read().splitlines() == sorted(lines)
+
+
+def test_streaming_matches_in_memory():
+    print("test_streaming_matches_in_memory")
+    import random
+    import shutil
+    import log_diff
+
+    rand = random.Random(0)
+    log_type = LOG_CONFIGS["logcat"]
+    pattern_matcher = PatternMatcher([("events", "onChangeEvent"), ("ids", "id = 5")])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = tmpdir + "/test.log"
+        with open(path, "w") as f:
+            for i in range(500):
+                pid = rand.choice([4451, 4688, 5012])
+                tid = pid + rand.randrange(3)
+                level = rand.choice("DIWE")
+                tag = "Tag%d" % rand.randrange(20)
+                content = "onChangeEvent id = %d" % rand.randrange(10)
+                f.write(
+                    "03-24 08:36:%02d.%03d  %d  %d %s %s: %s\n"
+                    % (i // 60, i % 1000, pid, tid, level, tag, content)
+                )
+                if i % 50 == 0:
+                    f.write("garbage line %d\n" % i)
+        folders = []
+        try:
+            with open(path) as f:
+                folders.append(
+                    store_relevant_data_in_a_tmp_folder(
+                        f, log_type, DEFAULT_GROUP_KEYS, pattern_matcher
+                    )
+                )
+            with open(path) as f:
+                # Fewer open files than groups so that files are reopened
+                folders.append(
+                    stream_relevant_data_in_a_tmp_folder(
+                        f, log_type, DEFAULT_GROUP_KEYS, 8, pattern_matcher
+                    )
+                )
+            summary = log_diff.compare_folders(*folders)
+            assert summary["identical"] > 8, summary
+            assert not summary["only_in_reference"], summary
+            assert not summary["only_in_compared"], summary
+            assert not summary["different"], summary
+        finally:
+            for folder in folders:
+                shutil.rmtree(folder)
 
 
 if __name__ == "__main__":
@@ -197,7 +655,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "files",
-        type=argparse.FileType("r", encoding="ISO-8859-1"),
+        type=open_log_file,
         nargs="+",
         help="Input files",
     )
@@ -205,36 +663,57 @@ if __name__ == "__main__":
     parser.add_argument(
         "-difftool", default="meld", help="Diff tool such as meld or kompare"
     )
-    default_group_keys = [
-        "tag",
-        "threadname",
-        "threadid",
-        "level",
-        "processname",
-        "processid",
-        "processthreadnames",
-        "patterns",
-        "ALL",
-        "ALL_sorted",
-    ]
     parser.add_argument(
-        "-key",
-        action="append",
-        help="Keys used to group lines in folders. Unavailable values are ignored. Values available depend on the format used: ALL for all formats, then %s. Default value: %s."
-        % (
-            ";".join(
-                " for %s: %s"
-                % (log_type.name, ", ".join(log_type.regex.groupindex.keys()))
-                for log_type in LOG_TYPES
-            ),
-            default_group_keys,
-        ),
+        "-report",
+        choices=["text", "json"],
+        help="Compare folders with the built-in diff engine and print a summary in the given format instead of using the diff tool",
     )
+    parser.add_argument(
+        "-report-limit",
+        default=DEFAULT_REPORT_LIMIT,
+        type=int,
+        help="Maximum number of groups listed in each section of the text report. Defaults to %d"
+        % DEFAULT_REPORT_LIMIT,
+    )
+    parser.add_argument(
+        "-streaming",
+        action="store_true",
+        help="Write lines to the output folders as they are parsed so that memory usage does not depend on the size of the files",
+    )
+    parser.add_argument(
+        "-jobs",
+        default=os.cpu_count(),
+        type=int,
+        help="Number of processes used to handle files in parallel (1 to disable). Defaults to the number of CPUs",
+    )
+    add_extraction_arguments(parser)
 
     # Get arguments
     args = parser.parse_args()
-    group_keys = default_group_keys if args.key is None else args.key
-    log_type = get_log_config_from_arg(args.format, args.files)
+    group_keys = get_group_keys(args)
+    pattern_matcher = get_pattern_matcher(args)
+    files = args.files
+    executor = None
+    if args.jobs > 1 and len(files) > 1 and can_be_processed_in_parallel(files):
+        import concurrent.futures
+
+        executor = concurrent.futures.ProcessPoolExecutor(min(args.jobs, len(files)))
+        log_type = get_log_config_from_arg_in_parallel(args.format, files, executor)
+    else:
+        log_type = get_log_config_from_arg(args.format, files)
 
     # Perform comparison
-    compare_files(args.files, log_type, group_keys, args.difftool)
+    compare_files(
+        files,
+        log_type,
+        group_keys,
+        args.difftool,
+        args.streaming,
+        args.max_open_files,
+        executor,
+        args.report,
+        args.report_limit,
+        pattern_matcher,
+    )
+    if executor is not None:
+        executor.shutdown()
@@ -0,0 +1,113 @@
+"""
+This module is used to mine message templates from log lines with the Drain
+algorithm, in a single pass:
+ - lines are dispatched in a fixed depth prefix tree using their number of
+   tokens and their first tokens
+ - in the leaf reached, the line joins the most similar cluster or creates a
+   new one
+ - tokens differing between lines of a cluster are replaced by a wildcard in
+   the template of the cluster
+"""
+
+WILDCARD = "<*>"
+
+
+def has_digit(token):
+    return any(c.isdigit() for c in token)
+
+
+class LogCluster:
+    """Group of lines sharing the same template."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.count = 1
+
+    def get_template(self):
+        return " ".join(self.tokens)
+
+    def get_similarity(self, tokens):
+        """Get ratio of tokens equal to the template and number of wildcards in the template."""
+        if not tokens:
+            return 1.0, 0
+        same = sum(t1 == t2 for t1, t2 in zip(self.tokens, tokens))
+        return same / len(tokens), self.tokens.count(WILDCARD)
+
+    def add(self, tokens):
+        self.count += 1
+        self.tokens = [
+            t1 if t1 == t2 else WILDCARD for t1, t2 in zip(self.tokens, tokens)
+        ]
+
+
+class TemplateMiner:
+    """Cluster lines into templates with the Drain algorithm."""
+
+    def __init__(self, depth=4, similarity_threshold=0.4, max_children=100):
+        # Depth includes the root and the layer for the number of tokens
+        self.nb_prefix_tokens = depth - 2
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self.root = dict()
+        self.clusters = []
+
+    def get_leaf_clusters(self, tokens):
+        node = self.root.setdefault(len(tokens), dict())
+        for token in tokens[: self.nb_prefix_tokens]:
+            # Tokens with digits are likely to be variables
+            key = WILDCARD if has_digit(token) else token
+            if key not in node and len(node) >= self.max_children:
+                key = WILDCARD
+            node = node.setdefault(key, dict())
+        # Clusters are stored with the None key which can not be a token
+        return node.setdefault(None, [])
+
+    def add(self, line):
+        """Add line to the relevant cluster - return the cluster."""
+        tokens = line.split()
+        clusters = self.get_leaf_clusters(tokens)
+        best, best_similarity = None, (-1.0, -1)
+        for cluster in clusters:
+            similarity = cluster.get_similarity(tokens)
+            if similarity > best_similarity:
+                best, best_similarity = cluster, similarity
+        if best is not None and best_similarity[0] >= self.similarity_threshold:
+            best.add(tokens)
+            return best
+        cluster = LogCluster(tokens)
+        clusters.append(cluster)
+        self.clusters.append(cluster)
+        return cluster
+
+    def get_template_counts(self):
+        """Get dictionnary mapping templates to the number of lines they match."""
+        counts = dict()
+        for cluster in self.clusters:
+            template = cluster.get_template()
+            counts[template] = counts.get(template, 0) + cluster.count
+        return counts
+
+
+# TESTS
+#########################################
+def test_template_miner():
+    print("test_template_miner")
+    miner = TemplateMiner()
+    lines = [
+        "Connected to 192.168.1.%d port %d" % (i, 8000 + i) for i in range(10)
+    ] + ["Battery level %d%%" % i for i in range(5)] + ["Screen off"] * 3
+    clusters = [miner.add(line) for line in lines]
+    assert clusters[0] is clusters[9]
+    assert clusters[10] is clusters[14]
+    assert clusters[0] is not clusters[10]
+    assert miner.get_template_counts() == {
+        "Connected to <*> port <*>": 10,
+        "Battery level <*>": 5,
+        "Screen off": 3,
+    }, miner.get_template_counts()
+    # Lines with a different number of tokens never share a template
+    assert miner.add("Screen off now") is not clusters[-1]
+
+
+if __name__ == "__main__":
+    test_template_miner()
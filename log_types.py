@@ -1,9 +1,10 @@
 # Information about log and how to handle them:
 #  - how to parse them
 #  - how to parse the date
+import os
 import re
+import sys
 import datetime
-import locale
 
 
 def get_date_from_str_and_format(string, date_format):
@@ -29,6 +30,19 @@ def get_posix_ts_from_date(date_obj, ratio):
 def get_date_methods_from_posix(ratio = 1.0):
     return lambda s: get_date_from_posix_ts(s, ratio), lambda d: get_posix_ts_from_date(d, ratio)
 
+class LazyRegex:
+    """Regexp compiled on first use so that importing formats is cheap."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.compiled = None
+
+    def __get__(self, obj, owner=None):
+        if self.compiled is None:
+            self.compiled = re.compile(self.pattern)
+        return self.compiled
+
+
 class LogType:
     """Generic class for log types."""
 
@@ -52,7 +66,7 @@ class UlogcatLongLogType(LogType):
         "03-24 08:39:18.608 I             (debug-logpacka-2055/debug-logpacka-2088): logpackager-ulogcat-stream-plugin: Recording is stopped",
     ]
 
-    regex = re.compile(
+    regex = LazyRegex(
         r"^(?P<date>\d\d-\d\d \d\d:\d\d:\d\d.\d\d\d) (?P<level>.) (?P<tag>[^( ]*)\s*\((?:(?P<processname>.*)-(?P<processid>.*)\/)?(?P<threadname>[^\/]*)-(?P<threadid>\d+)\)\s*: ?(?P<content>.*)$"
     )
 
@@ -68,7 +82,7 @@ class UlogcatShortLogType(LogType):
         "N SENSORS     (sensors-manager)                : Sensor Manager starting (compiled from v42.1.1 on the Jan  2 2023 at 13:43:15)",
         "I BAGADBACK   (sensors-manager)                : notifyConnStatus: Server connected",
     ]
-    regex = re.compile(
+    regex = LazyRegex(
         r"^(?P<level>.) (?P<tag>[^( ]*)\s*\((?P<processname>[^)]*)\)\s*: ?(?P<content>.*)$"
     )
 
@@ -84,7 +98,7 @@ class LogcatLogType(LogType):
         "03-24 08:36:15.308  4451  4451 D VehiclePropertyService: onChangeEvent: property ignored",
     ]
 
-    regex = re.compile(
+    regex = LazyRegex(
         r"^(?P<date>\d\d-\d\d \d\d:\d\d:\d\d.\d\d\d)\s+(?P<processid>\d+)\s+(?P<threadid>\d+)\s+(?P<level>.)\s+(?P<tag>[^:]*):(?P<content>.*)$"
     )
 
@@ -102,7 +116,7 @@ class LogcatFromPctsFileLogType(LogType):
 		"02-25 10:08:55.538 D/BluetoothHeadset( 4307): Binding service...",
     ]
 
-    regex = re.compile(
+    regex = LazyRegex(
         r"^(?P<date>\d\d-\d\d \d\d:\d\d:\d\d.\d\d\d)\s+(?P<level>.)\/(?P<tag>[^:]*)\(\s*(?P<threadid>\d+)\):(?P<content>.*)$"
     )
 
@@ -110,7 +124,7 @@ class LogcatFromPctsFileLogType(LogType):
 
 
 # Regexp for a dmesg line
-DMESG_RE = re.compile(
+DMESG_RE = LazyRegex(
     r"^(<\d+>)?\[(?P<date>[^]]+)\](?P<tid>\[[^]]+\])? (?P<processid>[^:]*:)?(?P<content>.*)$"
 )
 
@@ -173,7 +187,7 @@ class JenkinsLogType(LogType):
         "[2023-04-20T13:46:18.263Z] [ 91% 1805/1973] //external/llvm/lib/Transforms/Vectorize:libLLVMVectorize clang++ BBVectorize.cpp [windows]",
     ]
 
-    regex = re.compile(
+    regex = LazyRegex(
         r"^\[(?P<date>[0-9TZ:.-]*)\](?P<progress> \[\s*\d+% \d+/\d+])? ?(?P<content>.*)$"
     )
 
@@ -192,7 +206,7 @@ class JournalCtlLogType(LogType):
         "nov. 06 14:14:13 hostname.ls.ege.ds tracker-store[762255]: OK",
         "nov. 06 14:14:13 hostname.ls.ege.ds systemd[4676]: tracker-store.service: Succeeded.",
     ]
-    regex = re.compile(
+    regex = LazyRegex(
         r"^(?P<date>.* \d+ \d+:\d+:\d+) (?P<hostname>.*) (?P<processname>.*)\[(?P<processid>\d+)]: (?P<content>.*)$"
     )
     date_obj_from_str, str_from_date_obj = get_date_methods_from_format("%b %d %H:%M:%S")
@@ -212,7 +226,7 @@ class SysLogLogType(LogType):
         "Nov  6 17:10:53 hostname systemd[1]: fwupd-refresh.service: Succeeded.",
     ]
 
-    regex = re.compile(
+    regex = LazyRegex(
         r"^(?P<date>[^ ]* +\d+ \d+:\d+:\d+) (?P<hostname>.*) (?P<content>.*)$"
     )
     date_obj_from_str, str_from_date_obj = get_date_methods_from_format("%b %d %H:%M:%S")
@@ -226,7 +240,7 @@ class ZazuSocLogType(LogType):
         "[I 2025-10-14 09:53:34] None                 b'I DISPMAN     (display-focus-m)                : onConnected: a new display session is connected\r'",
         '[I 2025-10-14 09:53:34] None                 b"I DISPMAN     (display-focus-m)                : DisplayFocusInterface::recvMessage: received register request for session\r"'
     ]
-    regex = re.compile(r"^\[I (?P<date>\d+-\d+-\d+ \d+:\d+:\d+)\] None\s+b['\"](?P<level>.) (?P<tag>[^( ]*)\s*\((?P<processname>.*)\)\s*: ?(?P<content>.*)$")
+    regex = LazyRegex(r"^\[I (?P<date>\d+-\d+-\d+ \d+:\d+:\d+)\] None\s+b['\"](?P<level>.) (?P<tag>[^( ]*)\s*\((?P<processname>.*)\)\s*: ?(?P<content>.*)$")
     date_obj_from_str, str_from_date_obj = get_date_methods_from_format("%Y-%m-%d %H:%M:%S")
 
 
@@ -239,7 +253,7 @@ class PctsLogTypes(LogType):
         '42563 I/ Start car connection',
         '42635 D/ Mapping channel 0 to service 1',
     ]
-    regex = re.compile(r"^(?P<date>\d+) (?P<level>.)/ (?P<content>.*)$")
+    regex = LazyRegex(r"^(?P<date>\d+) (?P<level>.)/ (?P<content>.*)$")
     date_obj_from_str, str_from_date_obj = get_date_methods_from_posix(1000.)
 
 
@@ -251,7 +265,7 @@ class RawLogType(LogType):
         "abc",
         "42",
     ]
-    regex = re.compile(r"^(?P<content>.*)$")
+    regex = LazyRegex(r"^(?P<content>.*)$")
     is_used_in_autodetect = False
 
 
@@ -260,7 +274,7 @@ class XxxLogType(LogType):
 
     name = "xxx"
     examples = []
-    regex = re.compile(r"^.*$")
+    regex = LazyRegex(r"^.*$")
 
 
 # FORMATS
@@ -300,6 +314,100 @@ LOG_CONFIG_ARG = {
     "default": AUTOMATIC_OPTION,
     "help": "Log format",
 }
+# Encoding used to read logs, with one byte per character
+LOG_ENCODING = "ISO-8859-1"
+
+
+def open_log(filename):
+    """Open log file from its name or descriptor.
+
+    Line endings are not translated so that the length of the lines read is
+    their size in bytes."""
+    closefd = not isinstance(filename, int)
+    return open(filename, encoding=LOG_ENCODING, newline="", closefd=closefd)
+
+
+def open_log_file(filename):
+    """Argparse type opening a log file, "-" being the standard input."""
+    if filename == "-":
+        return sys.stdin
+    try:
+        return open_log(filename)
+    except OSError as e:
+        import argparse
+
+        raise argparse.ArgumentTypeError("can't open '%s': %s" % (filename, e))
+
+
+def get_field_names(log_type):
+    """Get names of the fields from the regexp of the log type without compiling it."""
+    for klass in log_type.__mro__:
+        regex = vars(klass).get("regex")
+        if isinstance(regex, LazyRegex):
+            return re.findall(r"\(\?P<(\w+)>", regex.pattern)
+    return []
+
+
+# AUTODETECTION
+#########################################
+# Environment variable providing the path to an optional file used to cache
+# results of the autodetection: on a hit, only the regexp of the format found
+# is compiled and the input files are not read beforehand.
+AUTODETECT_CACHE_ENV = "LOGSCRIPTS_AUTODETECT_CACHE"
+# Maximum number of entries in the autodetection cache
+AUTODETECT_CACHE_SIZE = 1000
+
+
+def get_autodetect_cache_key(input_files):
+    """Get key identifying the content of the input files, None if they are not regular files."""
+    keys = []
+    for f in input_files:
+        try:
+            st = os.stat(f.name)
+        except (OSError, TypeError):
+            return None
+        path = os.path.realpath(f.name)
+        keys.append("%s:%d:%d" % (path, st.st_size, st.st_mtime_ns))
+    return "|".join(keys)
+
+
+def read_autodetect_cache(cache_file):
+    import json
+
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def get_cached_log_type(input_files):
+    cache_file = os.environ.get(AUTODETECT_CACHE_ENV)
+    if cache_file:
+        key = get_autodetect_cache_key(input_files)
+        name = read_autodetect_cache(cache_file).get(key)
+        if name in LOG_CONFIGS:
+            print("Using", name, "(from autodetection cache)")
+            return LOG_CONFIGS[name]
+    return None
+
+
+def set_cached_log_type(input_files, log_type):
+    cache_file = os.environ.get(AUTODETECT_CACHE_ENV)
+    key = get_autodetect_cache_key(input_files) if cache_file else None
+    if key is not None:
+        import json
+
+        cache = read_autodetect_cache(cache_file)
+        cache.pop(key, None)
+        cache[key] = log_type.name
+        # Keep most recent entries only
+        cache = dict(list(cache.items())[-AUTODETECT_CACHE_SIZE:])
+        # Replace file atomically as several processes may use the cache
+        tmp_file = "%s.%d" % (cache_file, os.getpid())
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
 
 
 def count_matches(log_type, lst_of_lst_of_lines):
@@ -311,36 +419,169 @@ def count_matches(log_type, lst_of_lst_of_lines):
     return count
 
 
-def detect_log_type(lst_of_lst_of_lines):
-    match_count = [
+def get_match_counts(lst_of_lst_of_lines):
+    return [
         (log_type, count_matches(log_type, lst_of_lst_of_lines))
         for log_type in LOG_TYPES
         if log_type.is_used_in_autodetect
     ]
+
+
+def get_best_log_types(match_count):
     max_count = max(count for _, count in match_count)
     return [log_type for log_type, count in match_count if count == max_count]
 
 
+def detect_log_type(lst_of_lst_of_lines):
+    return get_best_log_types(get_match_counts(lst_of_lst_of_lines))
+
+
+def choose_detected_log_type(detected):
+    used = detected[0]
+    print("Using", used.name, "(chosen among the top", len(detected), "matches)")
+    return used
+
+
 def get_log_config_from_arg(log_type_name, input_files):
     if log_type_name in LOG_CONFIGS:
         return LOG_CONFIGS[log_type_name]
     assert log_type_name == AUTOMATIC_OPTION
+    cached = get_cached_log_type(input_files)
+    if cached is not None:
+        return cached
     lst_of_lst_of_lines = [list(f) for f in input_files]
     # Reset to beginning of file
     for f in input_files:
         f.seek(0)
-    detected = detect_log_type(lst_of_lst_of_lines)
-    used = detected[0]
-    print("Using", used.name, "(chosen among the top", len(detected), "matches)")
+    used = choose_detected_log_type(detect_log_type(lst_of_lst_of_lines))
+    set_cached_log_type(input_files, used)
     return used
 
 
+# PARSING
+#########################################
+# Default maximum number of examples of lines not matching the format
+MAX_UNMATCHED_EXAMPLES = 10
+# Default maximum number of lines not matching the format which are checked
+# against the other formats
+MAX_UNMATCHED_CLASSIFIED = 10000
+
+
+class UnmatchedReport:
+    """Report about lines not matching the format, using a fixed amount of memory.
+
+    Lines are counted and a few examples are kept with reservoir sampling,
+    along with their position. The first lines are also classified according
+    to the other formats they match, to detect a wrong format or a file
+    mixing several formats."""
+
+    def __init__(
+        self,
+        log_type,
+        max_examples=MAX_UNMATCHED_EXAMPLES,
+        max_classified=MAX_UNMATCHED_CLASSIFIED,
+    ):
+        self.log_type = log_type
+        self.max_examples = max_examples
+        self.max_classified = max_classified
+        self.count = 0
+        self.examples = []
+        self.counts_by_formats = dict()
+        self.random = None
+
+    def add(self, line, line_number=None, offset=None):
+        self.count += 1
+        example = (line_number, offset, line)
+        if len(self.examples) < self.max_examples:
+            self.examples.append(example)
+        else:
+            if self.random is None:
+                import random
+
+                # Fixed seed for reproducible reports
+                self.random = random.Random(0)
+            i = self.random.randrange(self.count)
+            if i < self.max_examples:
+                self.examples[i] = example
+        if self.count <= self.max_classified:
+            formats = ", ".join(
+                log_type.name
+                for log_type in LOG_TYPES
+                if log_type.is_used_in_autodetect
+                and log_type is not self.log_type
+                and log_type.regex.match(line)
+            )
+            count = self.counts_by_formats.get(formats, 0)
+            self.counts_by_formats[formats] = count + 1
+
+    def print_report(self, name, nb_lines):
+        if not self.count:
+            return
+        print(
+            "%s lines from %s did not match %s (out of %s):"
+            % (self.count, name, self.log_type.name, nb_lines)
+        )
+        classified = min(self.count, self.max_classified)
+        print(
+            " other formats matching%s:"
+            % ("" if classified == self.count else " (first %d lines)" % classified)
+        )
+        for formats, count in sorted(
+            self.counts_by_formats.items(), key=lambda item: item[1], reverse=True
+        ):
+            print("  %8d %s" % (count, formats or "no other format"))
+        print(" %d examples:" % len(self.examples))
+        for line_number, offset, line in sorted(
+            self.examples, key=lambda example: example[0] or 0
+        ):
+            if line_number is not None:
+                print("  line %d (offset %d): '%s'" % (line_number, offset, line))
+            else:
+                print("  '" + line + "'")
+
+
+def iter_parsed_lines(input_file, log_type, unmatched_report=None):
+    """Yield (line, dictionnary of fields) for non-empty lines from file, fields being None for lines not matching the format.
+
+    Lines not matching the format are added to the report provided with their
+    line number and offset (in bytes for files opened with open_log_file)."""
+    log_re = log_type.regex
+    offset = 0
+    for line_number, raw_line in enumerate(input_file, 1):
+        line = raw_line.strip()
+        if line:
+            m = log_re.match(line)
+            if m is None and unmatched_report is not None:
+                unmatched_report.add(line, line_number, offset)
+            yield line, None if m is None else m.groupdict()
+        offset += len(raw_line)
+
+
+def analyse_file(input_file, log_type, analyses):
+    """Parse file once and feed the lines to the analyses provided.
+
+    Analyses are objects with:
+     - an add(line, fields) method called for each line, fields being None for lines not matching the format
+     - a finish() method called once the whole file is parsed."""
+    unmatched_report = UnmatchedReport(log_type)
+    nb_lines = 0
+    for line, fields in iter_parsed_lines(input_file, log_type, unmatched_report):
+        nb_lines += 1
+        for analysis in analyses:
+            analysis.add(line, fields)
+    unmatched_report.print_report(input_file.name, nb_lines)
+    for analysis in analyses:
+        analysis.finish()
+
+
 # TESTS
 #########################################
 def test_log_type_for_examples(log_type):
     print("test_log_type_for_examples:", log_type.name)
     log_re = log_type.regex
     date_obj_from_str, str_from_date_obj = log_type.date_obj_from_str, log_type.str_from_date_obj
+    import locale
+
     local = log_type.date_locale
     # Save original locale
     prev_locale = locale.setlocale(locale.LC_ALL)